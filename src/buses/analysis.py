@@ -20,6 +20,11 @@ if __name__ == "__main__":
         except ValueError:
             raise Exception(f"{i} is not a number")
         return i
+    def parse_speeds(arg):
+        speeds = [check_positive(x.strip()) for x in arg.split(",") if x.strip()]
+        if not speeds:
+            raise argparse.ArgumentTypeError("At least one speed must be provided.")
+        return sorted(set(speeds))
     def parse_lines(arg):
         lines = [x.strip() for x in arg.split(",") if x.strip()]
         if not lines:
@@ -29,14 +34,22 @@ if __name__ == "__main__":
     parser.add_argument("data_dir", help="Path to the bus data directory.")
     parser.add_argument("-s", "--speed", type=check_positive, nargs='?',
                         help="Average speed to compare statistics. Must be a positive number (default 50)")
+    parser.add_argument("--speeds", type=parse_speeds,
+                        help="Comma-separated list of speeds to report in one pass (e.g., 20,50); overrides -s")
     parser.add_argument("--top_streets", type=check_positive,
                         help="Number of streets to print in summary. Must be a positive number (default 20)")
     parser.add_argument("-l", "--lines", type=parse_lines,
                         help="Comma-separated list of bus lines to map (e.g., 123,220,401)")
+    parser.add_argument("--smooth", action="store_true",
+                        help="Calculate speeds from Kalman-smoothed paths instead of raw positions")
+    parser.add_argument("--raster", action="store_true",
+                        help="Also build a map of mean speeds per grid cell every 5 minutes")
 
     args = parser.parse_args()
     if args.speed:
         global_data.COMPARISON_SPEED = args.speed
+    if args.speeds:
+        global_data.COMPARISON_SPEED = args.speeds[0]
     if args.top_streets:
         global_data.TOP_STREET_NUMBER = int(args.top_streets)
 
@@ -46,15 +59,23 @@ if __name__ == "__main__":
 
     # print(f"Using data in directory: {data_path}")
 
-    data = BusData(data_path)
+    data = BusData(data_path, smoothed=args.smooth)
     # data.visualize_bus_path("2210")  # specific physical vehicle, not line
     if args.lines:
         data.visualize_lines(args.lines)
         print(f"Bus lines mapped.")
-    data.report_speeds()
-    print(f"Speeds calculated.")
-    data.report_speeding_places()
-    print(f"Speeding places reported.")
-    data.visualize_speeding_places()
-    print(f"Speeding places mapped.")
-    print(f"Report finished successfully. Can be found in {data.output_dir}")
+    if args.speeds:
+        data.report_speed_thresholds(args.speeds)
+        print(f"Reports for speeds {', '.join(str(s) for s in args.speeds)} finished successfully. "
+              f"Can be found in {global_data.OUTPUT_DIR}")
+    else:
+        data.report_speeds()
+        print(f"Speeds calculated.")
+        data.report_speeding_places()
+        print(f"Speeding places reported.")
+        data.visualize_speeding_places()
+        print(f"Speeding places mapped.")
+        print(f"Report finished successfully. Can be found in {data.output_dir}")
+    if args.raster:
+        data.report_speed_raster()
+        print(f"Speed raster built. Can be found in {data.output_dir}")
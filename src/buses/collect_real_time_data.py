@@ -19,7 +19,7 @@ def fetch_bus_positions(start_time):
     url = (global_data.ZMT_API_URL +
            "busestrams_get?type=1&resource_id=f2e5503e927d-4ad3-9500-4ab9e55deb59&apikey=" +
            config.API_KEY)
-    timeout_duration = 5  # seconds
+    timeout_duration = 5 * global_data.COLLECTION_INTERVAL / 60  # seconds, 5 of a 60 s interval
 
     try:
         response = requests.get(url, timeout=timeout_duration)
@@ -43,7 +43,7 @@ def fetch_bus_positions(start_time):
         print(f"Downloading error: {response.status_code}")
         return None
     except requests.Timeout:
-        print(f"Request timed out after {timeout_duration} seconds.")
+        print(f"Request timed out after {timeout_duration:g} seconds.")
         return None
     except requests.RequestException as e:
         print(f"An error occurred: {e}")
@@ -58,7 +58,7 @@ def collect_data(start_hour=RIGHT_NOW, start_minute=RIGHT_NOW):
 
     start_time = datetime.datetime.now()
     current_time = datetime.datetime.now()
-    interval_seconds = 60
+    interval_seconds = global_data.COLLECTION_INTERVAL
 
     if start_hour != RIGHT_NOW:
         target_time = start_time.replace(hour=start_hour, minute=start_minute, second=0, microsecond=0)
@@ -78,11 +78,13 @@ def collect_data(start_hour=RIGHT_NOW, start_minute=RIGHT_NOW):
     if not os.path.exists(new_data_dir):
         os.makedirs(new_data_dir)
 
-    print(f"Starting download in {new_data_dir}; ends in {global_data.MINUTES} minutes.")
+    duration = global_data.MINUTES * interval_seconds / 60
+    print(f"Starting download in {new_data_dir}; ends in {duration:g} minutes ({global_data.MINUTES} downloads).")
+    file_format = '%H-%M-%S' if interval_seconds >= 1 else '%H-%M-%S-%f'  # unique names when sped up
 
     for i in range(global_data.MINUTES):
         current_time = datetime.datetime.now()
-        file_name = os.path.join(new_data_dir, f"{current_time.strftime('%H-%M-%S')}.txt")
+        file_name = os.path.join(new_data_dir, f"{current_time.strftime(file_format)}.txt")
 
         for _ in range(3):  # max 3 tries to get this minute's data
             records = fetch_bus_positions(start_time)
@@ -91,7 +93,7 @@ def collect_data(start_hour=RIGHT_NOW, start_minute=RIGHT_NOW):
                     json.dump(records, f, ensure_ascii=False, indent=4)
                 print(f"File created: {current_time.strftime('%H:%M:%S')}")
                 break
-            time.sleep(1)  # retry in a second
+            time.sleep(interval_seconds / 60)  # retry in a second (of a 60 s interval)
             print(f"Request failed: {current_time.strftime('%H:%M:%S')}")
 
         if i != global_data.MINUTES - 1:
@@ -119,11 +121,22 @@ if __name__ == "__main__":
         except ValueError:
             raise Exception(f"{i} is not an integer")
         return i
+    def interval(i):
+        try:
+            i = float(i)
+            if i <= 0:
+                raise argparse.ArgumentTypeError(f"{i} is not a positive number")
+        except ValueError:
+            raise Exception(f"{i} is not a number")
+        return i
     
     parser.add_argument("-t", "--time", type=hour_minute, nargs='?',
                         help="Scheduled start time in HH:MM (24-hour format) within the next 24 hours (default now)")
     parser.add_argument("-m", "--minutes", type=minutes, nargs='?',
                         help="Number of minutes to collect data. Must be an integer of at least 2 to collect any changes in bus positions (default 60)")
+    parser.add_argument("-i", "--interval", type=interval,
+                        help="Seconds between downloads, e.g. 0.6 against a replay server at 100x speed (default 60)")
+    parser.add_argument("-u", "--url", help=f"Base api url, e.g. of a replay server (default {global_data.ZMT_API_URL})")
 
     args = parser.parse_args()
     if args.time:
@@ -131,5 +144,9 @@ if __name__ == "__main__":
         start_minute = args.time.minute
     if args.minutes:
         global_data.MINUTES = args.minutes
+    if args.interval:
+        global_data.COLLECTION_INTERVAL = args.interval
+    if args.url:
+        global_data.ZMT_API_URL = args.url
     
     collect_data(start_hour, start_minute)
@@ -1,7 +1,9 @@
 """ Collects bus lines, streets and bus stops. """
 
+import argparse
 import os
 import requests
+from pathlib import Path
 
 import global_data
 import config
@@ -49,6 +51,20 @@ def fetch_bus_stops_today():
 ####################################################################################################
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect bus lines, streets and bus stops."
+    )
+    parser.add_argument("-u", "--url", help=f"Base api url, e.g. of a replay server (default {global_data.ZMT_API_URL})")
+    parser.add_argument("-o", "--output_dir", help=f"Directory to save the files in (default {global_data.DATA_DIR})")
+
+    args = parser.parse_args()
+    if args.url:
+        global_data.ZMT_API_URL = args.url
+    if args.output_dir:
+        global_data.DATA_DIR = Path(args.output_dir).resolve()
+        if not os.path.exists(global_data.DATA_DIR):
+            os.makedirs(global_data.DATA_DIR)
+
     fetch_bus_lines()
     fetch_vocab_dictionary()
     fetch_bus_stops_today()
@@ -7,12 +7,27 @@ from datetime import datetime
 from pathlib import Path
 
 MINUTES = 60  # minutes of bus data collection, > 1
+COLLECTION_INTERVAL = 60  # seconds between bus positions downloads
 
 COMPARISON_SPEED = 50  # base speed to compare buses, kmph
 MAX_SPEED = 100  # kmph
 MIN_SPEED = 1  # kmph
 TOP_STREET_NUMBER = 20  # how many streets to print in summary
 
+SHIFT_MIN_POINTS = 3  # shorter changes of line or brigade are merged or dropped
+SHIFT_MAX_GAP = 600  # seconds without positions after which a new shift starts
+
+SMOOTHING_STEP = 10  # seconds between smoothed positions
+SMOOTHING_MAX_GAP = 300  # seconds without positions after which a path is not smoothed
+GPS_NOISE = 10  # standard deviation of position measurements, metres
+ACCELERATION_NOISE = 0.5  # standard deviation of bus acceleration, m/s^2
+
+RASTER_CELL_SIZE = 500  # metres, side of a speed raster cell
+RASTER_BUCKET = 300  # seconds of a speed raster frame
+RASTER_MAX_SPEED = 50  # km/h, top of the speed raster colour scale, whatever the thresholds
+RASTER_MAP_FRAMES = 96  # frames with data shown on the raster map, the png frames have all
+WARSAW_BOUNDS = ((52.0, 20.6), (52.45, 21.35))  # south-west and north-east corners of the network
+
 ZMT_API_URL = "https://api.um.warszawa.pl/api/action/"
 
 ROOT_DIR = Path(__file__).resolve().parents[2]
@@ -72,3 +87,42 @@ def haversine_distance_vectorized(lat1, lon1, lat2, lon2):
     # Distance in kilometers
     distance = r * c
     return distance
+
+def closest_points(lat, lon, points_lat, points_lon, cell_size=0.5, chunk_size=1000):
+    """ Returns the index of the closest (by haversine distance) of points for every position.
+    Points are bucketed into cells of about cell_size kilometres, so each position is compared
+    only with points in its own and neighbouring cells. Positions with no point that close
+    are compared with all points, chunk_size positions at a time. """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    points_lat = np.asarray(points_lat, dtype=float)
+    points_lon = np.asarray(points_lon, dtype=float)
+    lat_step = cell_size / 111.195
+    lon_step = lat_step / np.cos(np.radians(np.mean(points_lat)))
+
+    point_cells = pd.DataFrame({"row": np.floor(points_lat / lat_step).astype(int),
+                                "col": np.floor(points_lon / lon_step).astype(int)})
+    cell_points = point_cells.groupby(["row", "col"]).indices
+    rows = np.floor(lat / lat_step).astype(int)
+    cols = np.floor(lon / lon_step).astype(int)
+
+    closest = np.full(len(lat), -1)
+    positions = pd.DataFrame({"row": rows, "col": cols}).groupby(["row", "col"]).indices
+    for (row, col), idx in positions.items():
+        candidates = [cell_points[(r, c)] for r in (row - 1, row, row + 1)
+                      for c in (col - 1, col, col + 1) if (r, c) in cell_points]
+        if not candidates:
+            continue
+        candidates = np.concatenate(candidates)
+        distances = haversine_distance(lat[idx, None], lon[idx, None],
+                                       points_lat[candidates], points_lon[candidates])
+        nearest = distances.argmin(axis=1)
+        # points outside the neighbouring cells are at least about cell_size away
+        sure = distances[np.arange(len(idx)), nearest] < 0.99 * cell_size
+        closest[idx[sure]] = candidates[nearest[sure]]
+
+    unsure = np.flatnonzero(closest < 0)
+    for start in range(0, len(unsure), chunk_size):
+        idx = unsure[start:start + chunk_size]
+        distances = haversine_distance(lat[idx, None], lon[idx, None], points_lat, points_lon)
+        closest[idx] = distances.argmin(axis=1)
+    return closest
@@ -12,18 +12,31 @@ import folium
 from itertools import cycle
 
 import global_data
+import smoothing
+from speed_raster import SpeedRaster
 
 class BusData:
-    def __init__(self, directory):
-        """ Prepares intervals from directory for further analysis. """
+    def __init__(self, directory, smoothed=False):
+        """ Prepares intervals from directory for further analysis. With smoothed, intervals
+        come from Kalman-smoothed paths on a uniform time grid instead of raw positions. """
 
         self.minutes_data = {}  # {Brigade, Lat, Lines, Lon, Time, VehicleNumber}
-        self.intervals_data = {}  # {speed, bus_stop, distance} intervals[i] for minutes[i]-[i+1]
+        self.intervals_data = {}  # {VehicleNumber, speed, distance, time_diff, mid_lat, mid_lon,
+        # mid_time} intervals[i] for minutes[i]-[i+1]
         self.bus_stops = {}  # {zespol, slupek, nazwa_zespolu, id_ulicy, szer_geo, dlug_geo,
         # kierunek, obowiazuje_od}
         self.streets = {}  # streets[id] = name
 
-        self.speeding_moments = []  # {Brigade, Lat, Lines, Lon, Time, VehicleNumber, street_name}
+        self.positions = pd.DataFrame()  # all unique moments sorted by VehicleNumber and Time
+        self.shifts = pd.DataFrame()  # {VehicleNumber, Lines, Brigade, start, end, first_row,
+        # last_row} continuous periods of a vehicle on one line and brigade, rows of positions
+        self.shift_index = {}  # shift_index[column][value] = shifts row numbers
+
+        self.sorted_moments = pd.DataFrame()  # all merged intervals sorted by speed, {Brigade, Lat,
+        # Lines, Lon, Time, VehicleNumber, speed, street_name}
+        self.sorted_speeds = np.array([])  # sorted_moments['speed'] for searchsorted
+        self.valid_speeds = np.array([])  # sorted speeds within MIN_SPEED-MAX_SPEED
+        self.attributed_from = 0  # sorted_moments[attributed_from:] have street names assigned
 
         self.start_time = ""
         self.end_time = ""
@@ -31,14 +44,17 @@ class BusData:
         self.min_buses = 50000
         self.max_buses = 0
 
-        data_name = os.path.basename(directory)
-        self.output_dir = os.path.join(global_data.OUTPUT_DIR, f"{data_name}-{int(global_data.COMPARISON_SPEED)}-report")
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        self.smoothed = smoothed
+        self.data_name = os.path.basename(directory)
+        self.output_dir = self.get_output_dir(global_data.COMPARISON_SPEED)
 
         self.load_static_data()
         self.load_real_time_moments(directory)
-        self.fill_intervals()
+        self.reconstruct_shifts()
+        if smoothed:
+            self.fill_smoothed_intervals()
+        else:
+            self.fill_intervals()
         # print("Preprocessing finished.\n")
 
     def __str__(self) -> str:
@@ -56,22 +72,37 @@ class BusData:
             info = f"Data from {dt1.strftime('%H:%M')} {day_of_week1} to {dt2.strftime('%H:%M')} {day_of_week2} " + info
         return info
 
+    def get_shifts(self, vehicle_number=None, line=None, brigade=None):
+        """ Returns shifts matching all of the given vehicle_number, line and brigade,
+        ordered by start time. """
+        rows = None
+        for column, value in (("VehicleNumber", vehicle_number), ("Lines", line),
+                              ("Brigade", brigade)):
+            if value is None:
+                continue
+            matches = self.shift_index.get(column, {}).get(str(value), np.array([], dtype=int))
+            rows = matches if rows is None else np.intersect1d(rows, matches)
+
+        shifts_df = self.shifts if rows is None else self.shifts.iloc[rows]
+        return shifts_df.sort_values(["start", "VehicleNumber"], kind="stable")
+
     def get_lines_for_vehicle(self, vehicle_number: str):
         """ Returns the line(s) that the given vehicle_number operated on
         across all collected minutes. """
-        lines = set()
-        for minute_df in self.minutes_data.values():
-            if "VehicleNumber" not in minute_df.columns or "Lines" not in minute_df.columns:
-                continue
-
-            matches = minute_df[minute_df["VehicleNumber"] == vehicle_number]
-            if not matches.empty:
-                lines.update(matches["Lines"].astype(str).unique())
+        lines = set(self.get_shifts(vehicle_number=vehicle_number)["Lines"])
 
         if not lines:
             print(f"No line data found for bus {vehicle_number}.")
         return lines
 
+    def get_output_dir(self, speed):
+        """ Returns (and creates) the report directory for the given speed threshold. """
+        report_name = f"{self.data_name}-{int(speed)}-{'smoothed-' if self.smoothed else ''}report"
+        output_dir = os.path.join(global_data.OUTPUT_DIR, report_name)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        return output_dir
+
     def new_speed_map(self):
         return folium.Map(location=[52.2297, 21.0122], zoom_start=12, tiles="CartoDB positron")
 
@@ -100,6 +131,66 @@ class BusData:
         self.end_time = self.minutes_data[len(files) - 1]['Time'].max()
         # print("Real time moments loaded.")
 
+    def reconstruct_shifts(self):
+        """ Joins all minutes into positions sorted by vehicle and time, and splits them into
+        shifts - continuous periods during which a vehicle kept the same line and brigade.
+        Changes of line or brigade for fewer than global_data.SHIFT_MIN_POINTS positions
+        between two parts of the same shift are merged into it, a gap of more than
+        global_data.SHIFT_MAX_GAP seconds starts a new shift, and shifts still shorter than
+        global_data.SHIFT_MIN_POINTS positions are left out. """
+
+        minute_dfs = [minute_df for minute_df in self.minutes_data.values()
+                      if "VehicleNumber" in minute_df.columns]
+        if not minute_dfs:
+            return
+
+        positions = pd.concat(minute_dfs, ignore_index=True).dropna(subset=["VehicleNumber"])
+        positions = positions.drop_duplicates(subset=["VehicleNumber", "Time", "Lat", "Lon"])
+        for column in ("VehicleNumber", "Lines", "Brigade"):  # keys compared as strings
+            positions[column] = positions[column].fillna("").astype(str)
+        positions = positions.sort_values(["VehicleNumber", "Time"], kind="stable",
+                                          ignore_index=True)
+
+        # runs of rows with the same vehicle, line and brigade
+        keys = positions[["VehicleNumber", "Lines", "Brigade"]].copy()
+        run_ids = keys.ne(keys.shift()).any(axis=1).cumsum() - 1
+        runs = keys.groupby(run_ids).first()
+        runs["size"] = run_ids.groupby(run_ids).size()
+
+        # short runs between two runs of the same vehicle, line and brigade are blips
+        before, after = runs.shift(1), runs.shift(-1)
+        blips = ((runs["size"] < global_data.SHIFT_MIN_POINTS) &
+                 (before["VehicleNumber"] == runs["VehicleNumber"]) &
+                 (after["VehicleNumber"] == runs["VehicleNumber"]) &
+                 (before["Lines"] == after["Lines"]) & (before["Brigade"] == after["Brigade"]))
+        runs.loc[blips, ["Lines", "Brigade"]] = before.loc[blips, ["Lines", "Brigade"]]
+        keys[["Lines", "Brigade"]] = runs.loc[run_ids, ["Lines", "Brigade"]].to_numpy()
+
+        # a new shift starts wherever the vehicle, line or brigade changes, or after a long gap
+        gaps = pd.to_datetime(positions["Time"]).diff().dt.total_seconds()
+        shift_starts = keys.ne(keys.shift()).any(axis=1) | (gaps > global_data.SHIFT_MAX_GAP)
+        shift_ids = shift_starts.cumsum() - 1
+
+        rows = pd.Series(positions.index, index=positions.index)
+        shifts = pd.DataFrame({
+            "VehicleNumber": keys["VehicleNumber"].groupby(shift_ids).first(),
+            "Lines": keys["Lines"].groupby(shift_ids).first(),
+            "Brigade": keys["Brigade"].groupby(shift_ids).first(),
+            "start": positions["Time"].groupby(shift_ids).first(),
+            "end": positions["Time"].groupby(shift_ids).last(),
+            "first_row": rows.groupby(shift_ids).first(),
+            "last_row": rows.groupby(shift_ids).last(),
+        })
+        shifts = shifts[shifts["last_row"] - shifts["first_row"] + 1 >=
+                        global_data.SHIFT_MIN_POINTS]
+        positions["shift"] = pd.Series(np.arange(len(shifts)), index=shifts.index).reindex(
+            shift_ids).fillna(-1).astype(int).to_numpy()  # -1 for left out positions
+        self.positions = positions
+        self.shifts = shifts.reset_index(drop=True)
+
+        self.shift_index = {column: self.shifts.groupby(column).indices
+                            for column in ("VehicleNumber", "Lines", "Brigade")}
+
     def load_static_data(self):
         """ Reads bus stops and city streets in json format. """
 
@@ -107,6 +198,9 @@ class BusData:
         with open(bus_stops_path, "r") as file:
             bus_stops_data = json.load(file)
             self.bus_stops = pd.DataFrame(bus_stops_data['result'])
+            self.bus_stops["Lat"] = self.bus_stops["values"].apply(lambda x: float(x[4]["value"]))
+            self.bus_stops["Lon"] = self.bus_stops["values"].apply(lambda x: float(x[5]["value"]))
+            self.bus_stops["street_name"] = self.bus_stops["values"].apply(lambda x: x[3]["value"])
         # print("Bus stops loaded.")
 
         streets_path = os.path.join(global_data.DATA_DIR, "dictionary.json")
@@ -117,7 +211,10 @@ class BusData:
 
     def fill_intervals(self):
         """ Calculates speeds of every bus between every position measurement. Updates all_moments
-        to store the number of uncorrupted moments. """
+        to store the number of uncorrupted moments. Keeps all intervals sorted by speed, so any
+        speed threshold can be applied later without recalculation. """
+
+        merged_dfs = []
 
         for i in range(len(self.minutes_data) - 1):
             if ('VehicleNumber' not in self.minutes_data[i].columns or 'VehicleNumber' not in
@@ -148,44 +245,111 @@ class BusData:
             valid_speed_mask = (merged_df['speed'] <= global_data.MAX_SPEED) & (
                     merged_df['speed'] >= global_data.MIN_SPEED)
 
+            # midpoints place intervals in space and time
+            merged_df['mid_lat'] = (merged_df['Lat'] + merged_df['Lat_next']) / 2
+            merged_df['mid_lon'] = (merged_df['Lon'] + merged_df['Lon_next']) / 2
+            time = pd.to_datetime(merged_df['Time'])
+            merged_df['mid_time'] = time + (pd.to_datetime(merged_df['Time_next']) - time) / 2
+
             self.intervals_data[i] = merged_df[valid_speed_mask][['VehicleNumber', 'speed',
-                                                                  'distance', 'time_diff']]
+                                                                  'distance', 'time_diff',
+                                                                  'mid_lat', 'mid_lon', 'mid_time']]
 
-            speeding_moments_df = merged_df[merged_df['speed'] >= global_data.COMPARISON_SPEED]
-            self.speeding_moments.append(speeding_moments_df)
+            merged_dfs.append(merged_df)
 
-        valid_speed_count = 0
-        for interval_df in self.intervals_data.values():
-            valid_speeds = interval_df[(interval_df['speed'] <= global_data.MAX_SPEED) &
-                                       (interval_df['speed'] >= global_data.MIN_SPEED)]
-            valid_speed_count += len(valid_speeds)
+        if merged_dfs:
+            self.sort_moments(pd.concat(merged_dfs, ignore_index=True))
 
-        self.all_moments = valid_speed_count
+    def fill_smoothed_intervals(self):
+        """ Fills intervals like fill_intervals, but from paths smoothed by
+        smoothing.smooth_positions, with one interval per global_data.SMOOTHING_STEP seconds
+        and the smoothed instantaneous speed. Speeding moments keep only one point per
+        global_data.COLLECTION_INTERVAL, the cadence of raw positions, so their counts
+        can be compared with raw reports. """
+
+        if self.positions.empty:
+            return
+
+        smoothed_df = smoothing.smooth_positions(self.positions)
+        smoothed_df['time_diff'] = global_data.SMOOTHING_STEP / 3600
+        smoothed_df['distance'] = smoothed_df['speed'] * smoothed_df['time_diff']
+        smoothed_df['mid_lat'] = smoothed_df['Lat']
+        smoothed_df['mid_lon'] = smoothed_df['Lon']
+        smoothed_df['mid_time'] = pd.to_datetime(smoothed_df['Time'])
+
+        valid_speed_mask = (smoothed_df['speed'] <= global_data.MAX_SPEED) & (
+                smoothed_df['speed'] >= global_data.MIN_SPEED)
+        valid_df = smoothed_df[valid_speed_mask]
+        for i, interval_df in valid_df.groupby('grid'):
+            self.intervals_data[i] = interval_df[['VehicleNumber', 'speed', 'distance',
+                                                  'time_diff', 'mid_lat', 'mid_lon', 'mid_time']]
+
+        thinning = max(1, round(global_data.COLLECTION_INTERVAL / global_data.SMOOTHING_STEP))
+        self.sort_moments(smoothed_df[smoothed_df['grid'] % thinning == 0])
+
+    def sort_moments(self, moments_df):
+        """ Stores moments_df sorted by speed, so any speed threshold can be applied with
+        searchsorted. Updates all_moments to store the number of moments with valid speeds. """
+
+        self.sorted_moments = moments_df.sort_values('speed', kind='stable')
+        self.sorted_moments['street_name'] = None
+        self.sorted_speeds = self.sorted_moments['speed'].to_numpy()
+        self.attributed_from = len(self.sorted_moments)
+
+        valid_mask = ((self.sorted_speeds <= global_data.MAX_SPEED) &
+                      (self.sorted_speeds >= global_data.MIN_SPEED))
+        self.valid_speeds = self.sorted_speeds[valid_mask]  # stays sorted
+        self.all_moments = len(self.valid_speeds)
 
     ################################################################################################
 
-    def number_of_speeding_buses(self) -> int:
-        """ Count unique buses that reached the speed of >= global_data.COMPARISON_SPEED. """
+    def get_speeding_moments(self, speed=None):
+        """ Returns all moments with speed >= speed (default global_data.COMPARISON_SPEED),
+        sliced from sorted_moments. """
+
+        if speed is None:
+            speed = global_data.COMPARISON_SPEED
+        start = np.searchsorted(self.sorted_speeds, speed, side="left")
+        return self.sorted_moments.iloc[start:].sort_index()  # back in chronological order
+
+    def number_of_speeding_buses(self, speed=None) -> int:
+        """ Count unique buses that reached the speed of >= speed
+        (default global_data.COMPARISON_SPEED). """
 
-        all_speeding_moments = pd.concat(self.speeding_moments, ignore_index=True)
-        high_speed_vehicle_count = all_speeding_moments['VehicleNumber'].nunique()
+        high_speed_vehicle_count = self.get_speeding_moments(speed)['VehicleNumber'].nunique()
         return high_speed_vehicle_count
 
-    def report_speeds(self):
-        """ Plots frequencies of speeds. Prints how many times someone was speeding. """
+    def get_speed_histogram(self, speed, interval=2):
+        """ Returns histogram bin edges with counts of all valid speeds and of speeds >= speed,
+        counted with searchsorted on the sorted valid speeds. """
 
-        all_intervals_df = pd.concat(self.intervals_data.values())
-        speeds_series = all_intervals_df['speed']
-        high_speed_count = (speeds_series >= global_data.COMPARISON_SPEED).sum()
-        high_speeds_series = speeds_series[speeds_series >= global_data.COMPARISON_SPEED]
+        max_speed = self.valid_speeds[-1]
+        bins = np.arange(interval, min(int(max_speed) + 5, 100), interval)
 
-        max_speed = speeds_series.max()
-        interval = 2
+        def count(edges):
+            # bins are half-open like in plt.hist, except the last one, which includes its edge
+            positions = np.searchsorted(self.valid_speeds, edges, side="left")
+            positions[-1] = np.searchsorted(self.valid_speeds, edges[-1], side="right")
+            return np.diff(positions)
+
+        all_counts = count(bins)
+        high_counts = count(np.maximum(bins, speed))
+        return bins, all_counts, high_counts
+
+    def report_speeds(self, speed=None):
+        """ Plots frequencies of speeds. Prints how many times someone was speeding
+        (default threshold global_data.COMPARISON_SPEED). """
+
+        if speed is None:
+            speed = global_data.COMPARISON_SPEED
+        output_dir = self.get_output_dir(speed)
+
+        speeds_series = pd.Series(self.valid_speeds, name="speed")
         colour = "yellow"
-        bins = range(interval, min(int(max_speed) + 5, 100), interval)
+        bins, all_counts, high_counts = self.get_speed_histogram(speed)
 
-        plt.hist(speeds_series, bins=bins, edgecolor=colour, color="red", alpha=0.9)
-        plt.hist(high_speeds_series, bins=bins, edgecolor="red", color=colour, alpha=0.9)
+        plt.hist(bins[:-1], bins=bins, weights=all_counts, edgecolor=colour, color="red", alpha=0.9)
+        plt.hist(bins[:-1], bins=bins, weights=high_counts, edgecolor="red", color=colour, alpha=0.9)
 
         plt.title("Speed Distribution of Vehicles Every Second")
         plt.xlabel(f"Average Speed (km/h)")
@@ -193,7 +357,7 @@ class BusData:
 
         text = (
             f"{self}\n"
-            f"{self.number_of_speeding_buses()} of all buses reached speeds of {global_data.COMPARISON_SPEED} km/h."
+            f"{self.number_of_speeding_buses(speed)} of all buses reached speeds of {speed} km/h."
         )
         stats = speeds_series.describe()
 
@@ -205,38 +369,45 @@ class BusData:
         plt.subplots_adjust(bottom=0.22)
 
         # plt.show()
-        plt.savefig(os.path.join(self.output_dir, f"graph-speed"), dpi=300)
+        plt.savefig(os.path.join(output_dir, f"graph-speed"), dpi=300)
         plt.close()
 
     ################################################################################################
 
-    def get_speeding_places_df(self):
-        """ Returns a DataFrame of all speeding moments with street names assigned. """
+    def assign_street_names(self, speed):
+        """ Assigns street names of the closest bus stops to all moments with speed >= speed.
+        Moments already assigned by a higher threshold are not recalculated. """
 
-        speeding_df = self.speeding_moments
-        bus_stops_df = self.bus_stops
+        start = np.searchsorted(self.sorted_speeds, speed, side="left")
+        if start >= self.attributed_from:
+            return
 
-        bus_stops_df["Lat"] = bus_stops_df["values"].apply(lambda x: float(x[4]["value"]))
-        bus_stops_df["Lon"] = bus_stops_df["values"].apply(lambda x: float(x[5]["value"]))
-        bus_stops_df["street_name"] = bus_stops_df["values"].apply(lambda x: x[3]["value"])
-        speeding_df = pd.concat(speeding_df, ignore_index=True)
+        bus_stops_df = self.bus_stops
+        new_df = self.sorted_moments.iloc[start:self.attributed_from]
 
-        def find_closest_bus_stop(row):
-            distances = global_data.haversine_distance(row["Lat"], row["Lon"], bus_stops_df["Lat"],
-                                                       bus_stops_df["Lon"])
-            closest_index = distances.idxmin()
-            return bus_stops_df.at[closest_index, "street_name"]
+        closest_stops = global_data.closest_points(new_df["Lat"], new_df["Lon"],
+                                                   bus_stops_df["Lat"], bus_stops_df["Lon"])
+        closest_stop_ids = bus_stops_df["street_name"].to_numpy()[closest_stops]
+        self.sorted_moments.loc[new_df.index, "street_name"] = pd.Series(
+            closest_stop_ids, index=new_df.index).map(self.streets)
+        self.attributed_from = start
 
-        speeding_df["closest_stop_id"] = speeding_df.apply(find_closest_bus_stop, axis=1)
-        speeding_df["street_name"] = speeding_df["closest_stop_id"].map(self.streets)
+    def get_speeding_places_df(self, speed=None):
+        """ Returns a DataFrame of all moments with speed >= speed
+        (default global_data.COMPARISON_SPEED) with street names assigned. """
 
-        return speeding_df
+        if speed is None:
+            speed = global_data.COMPARISON_SPEED
+        self.assign_street_names(speed)
+        return self.get_speeding_moments(speed)
 
-    def report_speeding_places(self):
+    def report_speeding_places(self, speed=None):
         """ Prints out global_data.TOP_STREET_NUMBER bus stops near which drivers drove
-        with speeds above global_data.COMPARISON_SPEED. """
-        speeding_df = self.get_speeding_places_df()
-        filename = os.path.join(self.output_dir, f"speeding-places.txt")
+        with speeds above speed (default global_data.COMPARISON_SPEED). """
+        if speed is None:
+            speed = global_data.COMPARISON_SPEED
+        speeding_df = self.get_speeding_places_df(speed)
+        filename = os.path.join(self.get_output_dir(speed), f"speeding-places.txt")
         
         if speeding_df.empty:
             output = "No speeding data available.\n"
@@ -248,7 +419,7 @@ class BusData:
         top_street_names = street_name_counts.most_common(global_data.TOP_STREET_NUMBER)
         
         output_lines = [
-            f"Top {global_data.TOP_STREET_NUMBER} bus stops near which a bus was going faster than {global_data.COMPARISON_SPEED} km/h:"
+            f"Top {global_data.TOP_STREET_NUMBER} bus stops near which a bus was going faster than {speed} km/h:"
         ]
         for street_name, count in top_street_names:
             output_lines.append(f"{street_name}: {count} times")
@@ -256,11 +427,14 @@ class BusData:
         with open(filename, "w") as f:
             f.write(output_str)
 
-    def visualize_speeding_places(self):
-        """ Plots speeding moments on a map as points with street names and speed. """
-        speeding_df = self.get_speeding_places_df()
+    def visualize_speeding_places(self, speed=None):
+        """ Plots moments with speed >= speed (default global_data.COMPARISON_SPEED) on a map
+        as points with street names and speed. """
+        if speed is None:
+            speed = global_data.COMPARISON_SPEED
+        speeding_df = self.get_speeding_places_df(speed)
         speed_map = self.new_speed_map()
-        filename = os.path.join(self.output_dir, f"map-speeding-places.html")
+        filename = os.path.join(self.get_output_dir(speed), f"map-speeding-places.html")
         
         if speeding_df.empty:
             # print("No speeding data available.")
@@ -287,27 +461,47 @@ class BusData:
 
         speed_map.save(filename)
 
-    ################################################################################################
+    def report_speed_thresholds(self, speeds):
+        """ Writes speed graph, speeding places and their map for every threshold in speeds
+        into separate report directories. Street names are assigned once, for the lowest
+        threshold, and shared by all reports. """
 
-    def get_bus_points(self, vehicle_number: str):
-        """ Returns all collected GPS points and timestamps for a given vehicle_number. """
-        all_points = []
-        all_timestamps = []
-        for minute_df in self.minutes_data.values():
-            if "VehicleNumber" not in minute_df.columns:
-                continue
+        self.assign_street_names(min(speeds))
+        for speed in speeds:
+            self.report_speeds(speed)
+            self.report_speeding_places(speed)
+            self.visualize_speeding_places(speed)
 
-            bus_points = minute_df[minute_df["VehicleNumber"] == vehicle_number]
-            if not bus_points.empty:
-                for _, row in bus_points.iterrows():
-                    try:
-                        lat, lon = float(row["Lat"]), float(row["Lon"])
-                        timestamp = row["Time"]
-                        all_points.append((lat, lon))
-                        all_timestamps.append(timestamp)
-                    except (KeyError, ValueError, TypeError):
-                        continue
+    def report_speed_raster(self):
+        """ Builds a SpeedRaster of all intervals and saves it with its frames as images and
+        as a time-animated map. """
 
+        if not self.intervals_data:
+            print("No intervals to build a speed raster.")
+            return
+
+        raster = SpeedRaster(pd.concat(self.intervals_data.values(), ignore_index=True))
+        raster.save(os.path.join(self.output_dir, "speed-raster.npz"))
+        raster.save_frames(os.path.join(self.output_dir, "speed-raster"))
+        raster.visualize(self.new_speed_map(), os.path.join(self.output_dir, "map-speed-raster.html"))
+
+    ################################################################################################
+
+    def get_bus_points(self, vehicle_number: str, shift=None):
+        """ Returns all collected GPS points and timestamps for a given vehicle_number,
+        or only these from the given shift (a row of shifts). """
+        if shift is not None:
+            bus_points = self.positions.iloc[shift["first_row"]:shift["last_row"] + 1]
+        elif self.positions.empty:
+            return [], []
+        else:
+            vehicles = self.positions["VehicleNumber"]
+            bus_points = self.positions.iloc[vehicles.searchsorted(str(vehicle_number), "left"):
+                                             vehicles.searchsorted(str(vehicle_number), "right")]
+
+        bus_points = bus_points.dropna(subset=["Lat", "Lon", "Time"])
+        all_points = list(zip(bus_points["Lat"].astype(float), bus_points["Lon"].astype(float)))
+        all_timestamps = bus_points["Time"].tolist()
         return all_points, all_timestamps
 
 
@@ -322,10 +516,13 @@ class BusData:
 
         bus_map = self.new_speed_map()
 
-        folium.PolyLine(
-            all_points, color="green", weight=3, opacity=0.5,
-            tooltip=f"Path of bus {vehicle_number} (line {self.get_lines_for_vehicle(vehicle_number)})"
-        ).add_to(bus_map)
+        for _, shift in self.get_shifts(vehicle_number=vehicle_number).iterrows():
+            shift_points, _ = self.get_bus_points(vehicle_number, shift)
+            folium.PolyLine(
+                shift_points, color="green", weight=3, opacity=0.5,
+                tooltip=f"Path of bus {vehicle_number} (line {shift['Lines']}, "
+                        f"brigade {shift['Brigade']}, {shift['start']} - {shift['end']})"
+            ).add_to(bus_map)
 
         n_points = len(all_points)
         min_opacity = 0.25
@@ -352,34 +549,28 @@ class BusData:
         bus_map.save(os.path.join(self.output_dir, f"map-bus-{vehicle_number}-path.html"))
 
     def visualize_lines(self, line_numbers: str):
-        """ Plots the paths of the first available bus for each line in line_numbers
-        on a single html map. """
+        """ Plots the path of the first shift of each line in line_numbers on a single html map.
+        Only the part of the path driven on that line is shown. """
 
         bus_map = self.new_speed_map()
         colours = cycle(["red", "orange", "green", "blue", "purple", "darkred", "darkgreen", "darkblue", "darkpurple"])
 
         for line in line_numbers:
-            # find the first bus with this line
-            vehicle_number = None
-            for minute_df in self.minutes_data.values():
-                if "VehicleNumber" not in minute_df.columns or "Lines" not in minute_df.columns:
-                    continue
-                match = minute_df[minute_df["Lines"] == line]
-                if not match.empty:
-                    vehicle_number = str(match.iloc[0]["VehicleNumber"])
-                    break
-
-            if not vehicle_number:
+            # find the first shift on this line
+            shifts_df = self.get_shifts(line=line)
+            if shifts_df.empty:
                 print(f"No bus found for line {line}. Skipping.")
                 continue
+            shift = shifts_df.iloc[0]
 
-            # collect points for this bus
-            all_points, all_timestamps = self.get_bus_points(vehicle_number)
+            # collect points for this shift only
+            all_points, all_timestamps = self.get_bus_points(shift["VehicleNumber"], shift)
             if not all_points:
                 continue
 
             colour = next(colours)
-            folium.PolyLine(all_points, color=colour, weight=3, opacity=0.8, tooltip=f"Line {line}").add_to(bus_map)
+            tooltip = f"Line {line} (bus {shift['VehicleNumber']}, brigade {shift['Brigade']})"
+            folium.PolyLine(all_points, color=colour, weight=3, opacity=0.8, tooltip=tooltip).add_to(bus_map)
             folium.Marker(all_points[0], icon=folium.Icon(color="green"), tooltip=f"{line} start: {all_timestamps[0]}").add_to(bus_map)
             folium.Marker(all_points[-1], icon=folium.Icon(color="red"), tooltip=f"{line} end: {all_timestamps[-1]}").add_to(bus_map)
 
@@ -0,0 +1,216 @@
+""" Local server replaying collected bus positions and static data like the Warsaw API,
+for testing collectors offline. """
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+import global_data
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+API_ERROR = "Błędna metoda lub parametry wywołania"  # api's string result on errors
+STATIC_FILES = {
+    "public_transport_routes": "bus_lines.json",
+    "public_transport_dictionary": "dictionary.json",
+    "dbtimetable_get": "bus_stops.json",
+}
+
+def load_snapshots(directory):
+    """ Reads bus positions files from directory, in order. Returns a list of
+    (capture time, records) where capture time is the latest Time in the file. """
+    snapshots = []
+    for file_name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, file_name), "r") as f:
+            records = json.load(f)["result"]
+        if isinstance(records, str) or not records:
+            continue
+        times = [item["Time"] for item in records if item.get("Time")]
+        captured = datetime.datetime.strptime(max(times), TIME_FORMAT)
+        snapshots.append((captured, records))
+    return snapshots
+
+class ReplayServer(ThreadingHTTPServer):
+    """ Serves snapshots on a clock running speedup times faster than real time, starting at
+    the first snapshot. Timestamps are shifted by a constant offset so the data looks live
+    at the server's start, keeping time differences (and so speeds) as recorded.
+    Injected delays are in seconds of the replay clock too. """
+
+    daemon_threads = True
+
+    def __init__(self, address, directory, speedup=1, latency=0, error_rate=0, timeout_rate=0,
+                 timeout_delay=10, seed=0, static_dir=None):
+        super().__init__(address, ReplayHandler)
+        self.static_dir = static_dir or global_data.DATA_DIR  # bus stops, lines and streets
+        self.snapshots = load_snapshots(directory)
+        if not self.snapshots:
+            raise FileNotFoundError(f"No bus positions found in {directory}")
+
+        self.speedup = speedup
+        self.latency = latency  # replay seconds added to every response
+        self.error_rate = error_rate  # fraction of positions responses with api's string error
+        self.timeout_rate = timeout_rate  # fraction of responses delayed by timeout_delay
+        self.timeout_delay = timeout_delay  # replay seconds
+        self.random = random.Random(seed)
+
+        self.start = time.monotonic()
+        self.time_shift = datetime.datetime.now().replace(microsecond=0) - self.snapshots[0][0]
+        self.shifted_records = {}  # shifted_records[snapshot index] = records with shifted Time
+        self.lock = threading.Lock()
+        self.requests = {}  # requests[endpoint] = count
+        self.errors = 0
+        self.timeouts = 0
+        self.position_requests = []  # replay clock seconds of arrival of every positions request
+
+    def replay_seconds(self):
+        """ Returns seconds passed on the replay clock since the first snapshot. """
+        return (time.monotonic() - self.start) * self.speedup
+
+    def current_records(self):
+        """ Returns the latest snapshot captured before the replay clock, with shifted Time.
+        Shifted snapshots are kept, so responses stay fast compared to sped up timeouts. """
+        seconds = self.replay_seconds()
+        now = self.snapshots[0][0] + datetime.timedelta(seconds=seconds)
+        index = 0
+        for i, (captured, _) in enumerate(self.snapshots):
+            if captured > now:
+                break
+            index = i
+        if index in self.shifted_records:
+            return self.shifted_records[index]
+
+        shifted = []
+        for item in self.snapshots[index][1]:
+            item = dict(item)
+            if item.get("Time"):
+                item_time = datetime.datetime.strptime(item["Time"], TIME_FORMAT)
+                item["Time"] = (item_time + self.time_shift).strftime(TIME_FORMAT)
+            shifted.append(item)
+        self.shifted_records[index] = shifted
+        return shifted
+
+    def summary(self) -> str:
+        """ Returns request counts and intervals between positions requests on the replay clock,
+        for checking collectors' throughput, scheduling and retries. """
+        lines = [f"Replayed {self.replay_seconds():.0f} s at {self.speedup}x speed."]
+        for endpoint, count in sorted(self.requests.items()):
+            lines.append(f"{endpoint}: {count} requests")
+        lines.append(f"Errors served: {self.errors}, timeouts served: {self.timeouts}")
+
+        intervals = [b - a for a, b in zip(self.position_requests, self.position_requests[1:])]
+        if len(intervals) > 1:
+            lines.append(f"Positions requests every {statistics.mean(intervals):.1f} s "
+                         f"(stdev {statistics.stdev(intervals):.1f} s, "
+                         f"min {min(intervals):.1f} s, max {max(intervals):.1f} s) of replay time")
+        return "\n".join(lines)
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        """ Answers like api.um.warszawa.pl/api/action/<endpoint>, ignoring the api key. """
+        server = self.server
+        endpoint = urlparse(self.path).path.rstrip("/").split("/")[-1]
+
+        with server.lock:
+            server.requests[endpoint] = server.requests.get(endpoint, 0) + 1
+            delayed = server.random.random() < server.timeout_rate
+            failed = server.random.random() < server.error_rate
+            if delayed:
+                server.timeouts += 1
+            if endpoint == "busestrams_get":
+                server.position_requests.append(server.replay_seconds())  # arrival, in order
+                if failed:
+                    server.errors += 1
+        time.sleep((server.latency + (server.timeout_delay if delayed else 0)) / server.speedup)
+
+        if endpoint == "busestrams_get":
+            result = API_ERROR if failed else server.current_records()
+            self.send_json(json.dumps({"result": result}, ensure_ascii=False).encode("utf-8"))
+        elif endpoint in STATIC_FILES:
+            file_path = os.path.join(server.static_dir, STATIC_FILES[endpoint])
+            if not os.path.exists(file_path):
+                self.send_error(404, f"No {STATIC_FILES[endpoint]} in {server.static_dir}")
+                return
+            with open(file_path, "rb") as f:  # as stored, leaving the files untouched
+                self.send_json(f.read())
+        else:
+            self.send_error(404, f"Unknown endpoint {endpoint}")
+
+    def send_json(self, body):
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):  # client already timed out
+            pass
+
+    def log_message(self, format, *args):
+        pass  # summary is printed on shutdown instead
+
+####################################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay collected bus positions as a local Warsaw API."
+    )
+
+    def non_negative(i):
+        try:
+            i = float(i)
+            if i < 0:
+                raise argparse.ArgumentTypeError(f"{i} is a negative number")
+        except ValueError:
+            raise Exception(f"{i} is not a number")
+        return i
+    def positive(i):
+        i = non_negative(i)
+        if i == 0:
+            raise argparse.ArgumentTypeError(f"{i} is not a positive number")
+        return i
+    def fraction(i):
+        i = non_negative(i)
+        if i > 1:
+            raise argparse.ArgumentTypeError(f"{i} is not between 0 and 1")
+        return i
+
+    parser.add_argument("data_dir", help="Path to the bus data directory to replay.")
+    parser.add_argument("-p", "--port", type=int, default=8000,
+                        help="Port to listen on (default 8000)")
+    parser.add_argument("-x", "--speedup", type=positive, default=1,
+                        help="How many times faster than real time to replay (default 1)")
+    parser.add_argument("--latency", type=non_negative, default=0,
+                        help="Seconds of replay time added to every response (default 0)")
+    parser.add_argument("--error_rate", type=fraction, default=0,
+                        help="Fraction of bus positions responses with api's error result (default 0)")
+    parser.add_argument("--timeout_rate", type=fraction, default=0,
+                        help="Fraction of responses delayed by timeout_delay (default 0)")
+    parser.add_argument("--timeout_delay", type=non_negative, default=10,
+                        help="Seconds of replay time of delay of timed out responses (default 10)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of injected errors and timeouts (default 0)")
+
+    args = parser.parse_args()
+    data_path = Path(args.data_dir).resolve()
+    if not data_path.is_dir():
+        raise FileNotFoundError(f"Provided path does not exist or is not a directory: {data_path}")
+
+    server = ReplayServer(("localhost", args.port), data_path, args.speedup, args.latency,
+                          args.error_rate, args.timeout_rate, args.timeout_delay, args.seed)
+    print(f"Replaying {len(server.snapshots)} snapshots of {data_path} at {args.speedup}x speed.")
+    print(f"Api url: http://localhost:{args.port}/api/action/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print()
+        print(server.summary())
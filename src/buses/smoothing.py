@@ -0,0 +1,210 @@
+""" Kalman smoothing of bus paths into positions and speeds on a uniform time grid. """
+
+import numpy as np
+import pandas as pd
+
+import global_data
+
+EARTH_RADIUS = 6371000  # metres
+CHUNK_SIZE = 512  # vehicles smoothed at once, limits memory for long sessions
+
+def kalman_filter(obs, dts, gps_noise, acceleration_noise):
+    """ Runs a constant-velocity Kalman filter over obs of shape (fixes, vehicles, 2), where
+    dts are seconds since the previous fix of each vehicle. The first fix of every vehicle
+    is in the first row, missing fixes at the end are NaN with dt 0. Both axes share
+    covariances, stored as (p00, p01, p11). Returns filtered means of shape
+    (fixes, vehicles, 2, [position, velocity]) and covariances of shape (fixes, vehicles, 3). """
+    n_fixes, n_vehicles, _ = obs.shape
+    r2 = gps_noise ** 2
+    q = acceleration_noise ** 2
+
+    means = np.zeros((n_fixes, n_vehicles, 2, 2))
+    covs = np.zeros((n_fixes, n_vehicles, 3))
+
+    # the first fix of a vehicle starts its path at rest with unknown velocity
+    mean = np.zeros((n_vehicles, 2, 2))
+    mean[..., 0] = obs[0]
+    p00 = np.full(n_vehicles, float(r2))
+    p01 = np.zeros(n_vehicles)
+    p11 = np.full(n_vehicles, (global_data.MAX_SPEED / 3.6) ** 2)
+
+    for k in range(n_fixes):
+        if k > 0:  # predict
+            dt = dts[k]
+            mean[..., 0] += dt[:, None] * mean[..., 1]
+            p00 = p00 + 2 * dt * p01 + dt ** 2 * p11 + q * dt ** 3 / 3
+            p01 = p01 + dt * p11 + q * dt ** 2 / 2
+            p11 = p11 + q * dt
+
+            z = obs[k]
+            update = ~np.isnan(z[:, 0])
+            k0 = np.where(update, p00 / (p00 + r2), 0)
+            k1 = np.where(update, p01 / (p00 + r2), 0)
+            innovation = np.where(update[:, None], z - mean[..., 0], 0)
+            mean[..., 0] += k0[:, None] * innovation
+            mean[..., 1] += k1[:, None] * innovation
+            p11 = p11 - k1 * p01
+            p00, p01 = (1 - k0) * p00, (1 - k0) * p01
+
+        means[k] = mean
+        covs[k, :, 0] = p00
+        covs[k, :, 1] = p01
+        covs[k, :, 2] = p11
+
+    return means, covs
+
+def rts_smoother(means, covs, dts, acceleration_noise):
+    """ Runs the Rauch-Tung-Striebel backward pass over filtered means and covariances,
+    returning smoothed means of the same shape. """
+    q = acceleration_noise ** 2
+
+    smoothed = means.copy()
+    for k in range(len(means) - 2, -1, -1):
+        dt = dts[k + 1]
+        a, b, c = covs[k, :, 0], covs[k, :, 1], covs[k, :, 2]
+
+        # predicted covariance of fix k + 1
+        pa = a + 2 * dt * b + dt ** 2 * c + q * dt ** 3 / 3
+        pb = b + dt * c + q * dt ** 2 / 2
+        pc = c + q * dt
+        det = pa * pc - pb ** 2
+
+        # gain C = P F^T (F P F^T + Q)^-1
+        fa, fb, fc, fd = a + dt * b, b, b + dt * c, c  # P F^T
+        c00 = (fa * pc - fb * pb) / det
+        c01 = (fb * pa - fa * pb) / det
+        c10 = (fc * pc - fd * pb) / det
+        c11 = (fd * pa - fc * pb) / det
+
+        predicted_position = means[k, ..., 0] + dt[:, None] * means[k, ..., 1]
+        d_position = smoothed[k + 1, ..., 0] - predicted_position
+        d_velocity = smoothed[k + 1, ..., 1] - means[k, ..., 1]
+        smoothed[k, ..., 0] += c00[:, None] * d_position + c01[:, None] * d_velocity
+        smoothed[k, ..., 1] += c10[:, None] * d_position + c11[:, None] * d_velocity
+
+    return smoothed
+
+def interpolate(start_state, end_state, duration, fraction):
+    """ Returns positions and velocities at fraction (0-1) of duration seconds between smoothed
+    states of shape (points, 2, [position, velocity]), by cubic Hermite interpolation, which
+    is exact for constant velocity. """
+    s = fraction[:, None]
+    h = duration[:, None]
+    p0, v0 = start_state[..., 0], start_state[..., 1]
+    p1, v1 = end_state[..., 0], end_state[..., 1]
+
+    position = ((2 * s ** 3 - 3 * s ** 2 + 1) * p0 + (s ** 3 - 2 * s ** 2 + s) * h * v0 +
+                (-2 * s ** 3 + 3 * s ** 2) * p1 + (s ** 3 - s ** 2) * h * v1)
+    velocity = ((6 * s ** 2 - 6 * s) * (p0 - p1) / h + (3 * s ** 2 - 4 * s + 1) * v0 +
+                (3 * s ** 2 - 2 * s) * v1)
+    return position, velocity
+
+def smooth_positions(positions, step=None, max_gap=None, gps_noise=None, acceleration_noise=None):
+    """ Smooths paths of all vehicles in positions (sorted by VehicleNumber and Time, like
+    BusData.positions) with a constant-velocity Kalman filter and RTS smoother, run at the
+    times of the fixes. Returns a DataFrame {VehicleNumber, Lines, Brigade, Time, Lat, Lon,
+    speed, grid} of smoothed positions and speeds (km/h) interpolated every step seconds,
+    skipping gaps between fixes longer than max_gap seconds.
+    Lines and Brigade are taken from the last fix before each point. """
+    step = step or global_data.SMOOTHING_STEP
+    max_gap = max_gap or global_data.SMOOTHING_MAX_GAP
+    gps_noise = gps_noise or global_data.GPS_NOISE
+    acceleration_noise = acceleration_noise or global_data.ACCELERATION_NOISE
+
+    positions = positions.dropna(subset=["Lat", "Lon", "Time"]).reset_index(drop=True)
+    times = pd.to_datetime(positions["Time"])
+    start = times.min().floor(f"{step}s")
+    seconds = (times - start).dt.total_seconds().to_numpy()
+    n_steps = int(np.ceil(seconds.max() / step)) + 1
+    grid_times = (start + pd.to_timedelta(np.arange(n_steps) * step, unit="s")).strftime(
+        "%Y-%m-%d %H:%M:%S").to_numpy()
+
+    vehicle_codes, vehicles = pd.factorize(positions["VehicleNumber"])  # sorted, so ascending
+    vehicle_first_rows = np.searchsorted(vehicle_codes, np.arange(len(vehicles)))
+    lines = positions["Lines"].to_numpy()
+    brigades = positions["Brigade"].to_numpy()
+
+    # local metric coordinates around the centre of the data
+    lat0 = np.radians(positions["Lat"].mean())
+    lon0 = np.radians(positions["Lon"].mean())
+    x = EARTH_RADIUS * np.cos(lat0) * (np.radians(positions["Lon"].to_numpy()) - lon0)
+    y = EARTH_RADIUS * (np.radians(positions["Lat"].to_numpy()) - lat0)
+
+    smoothed_dfs = []
+    for chunk_start in range(0, len(vehicles), CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHUNK_SIZE, len(vehicles))
+        n_vehicles = chunk_end - chunk_start
+        first_rows = vehicle_first_rows[chunk_start:chunk_end]
+        rows = np.arange(first_rows[0], np.searchsorted(vehicle_codes, chunk_end))
+        vehicle_idx = vehicle_codes[rows] - chunk_start
+        fix_idx = rows - first_rows[vehicle_idx]
+        n_fixes = np.bincount(vehicle_idx, minlength=n_vehicles)
+
+        # fixes of every vehicle stacked from the first row, padded with its last time
+        t = np.full((n_fixes.max(), n_vehicles), np.nan)
+        t[fix_idx, vehicle_idx] = seconds[rows]
+        t = np.fmax.accumulate(t, axis=0)
+        dts = np.diff(t, axis=0, prepend=t[:1])
+        obs = np.full((len(t), n_vehicles, 2), np.nan)
+        obs[fix_idx, vehicle_idx, 0] = x[rows]
+        obs[fix_idx, vehicle_idx, 1] = y[rows]
+
+        means, covs = kalman_filter(obs, dts, gps_noise, acceleration_noise)
+        smoothed = rts_smoother(means, covs, dts, acceleration_noise)
+
+        # grid points within [t_j, t_j+1) of every pair of fixes at most max_gap apart
+        next_dts = dts[1:]
+        pairs_kept = ((np.arange(len(next_dts))[:, None] < n_fixes - 1) &
+                      (next_dts > 0) & (next_dts <= max_gap))
+        vs, js = np.nonzero(pairs_kept.T)  # ordered by vehicle and time
+        t_start, t_end = t[js, vs], t[js + 1, vs]
+        first_steps = np.ceil(t_start / step).astype(int)
+        counts = np.ceil(t_end / step).astype(int) - first_steps
+        pairs = np.repeat(np.arange(len(js)), counts)
+        ks = first_steps[pairs] + np.arange(len(pairs)) - np.repeat(np.cumsum(counts) - counts,
+                                                                     counts)
+        vs, js = vs[pairs], js[pairs]
+        duration = t_end[pairs] - t_start[pairs]
+        position, velocity = interpolate(smoothed[js, vs], smoothed[js + 1, vs], duration,
+                                         (ks * step - t_start[pairs]) / duration)
+
+        source_rows = first_rows[vs] + js
+        smoothed_dfs.append(pd.DataFrame({
+            "VehicleNumber": vehicles[vs + chunk_start],
+            "Lines": lines[source_rows],
+            "Brigade": brigades[source_rows],
+            "Time": grid_times[ks],
+            "Lat": np.degrees(lat0 + position[:, 1] / EARTH_RADIUS),
+            "Lon": np.degrees(lon0 + position[:, 0] / (EARTH_RADIUS * np.cos(lat0))),
+            "speed": np.hypot(velocity[:, 0], velocity[:, 1]) * 3.6,
+            "grid": ks,
+        }))
+
+    return pd.concat(smoothed_dfs, ignore_index=True)
+
+####################################################################################################
+
+if __name__ == "__main__":
+    # regression check: buses at a known constant speed with irregular fix times
+    rng = np.random.default_rng(0)
+    n_vehicles, n_fixes, speed = 50, 60, 30  # km/h
+    gaps = rng.uniform(45, 75, (n_vehicles, n_fixes))
+    gaps[:, 0] = rng.uniform(0, 60, n_vehicles)
+    seconds = np.cumsum(gaps, axis=1).round()  # api's Time has whole seconds
+    heading = rng.uniform(0, 2 * np.pi, n_vehicles)[:, None]
+    metres = seconds * speed / 3.6
+    test_df = pd.DataFrame({
+        "VehicleNumber": np.repeat([f"{v:04d}" for v in range(n_vehicles)], n_fixes),
+        "Lines": "100",
+        "Brigade": "1",
+        "Time": (pd.Timestamp("2024-02-16 08:00:00") +
+                 pd.to_timedelta(seconds.ravel(), unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "Lat": (52.23 + np.degrees(metres * np.sin(heading) / EARTH_RADIUS)).ravel(),
+        "Lon": (21.01 + np.degrees(metres * np.cos(heading) /
+                                   (EARTH_RADIUS * np.cos(np.radians(52.23))))).ravel(),
+    })
+
+    speeds = smooth_positions(test_df)["speed"]
+    print(f"Smoothed speeds of {speed} km/h: {speeds.min():.2f}-{speeds.max():.2f} km/h "
+          f"(std {speeds.std():.3f})")
+    assert (speeds - speed).abs().max() < 0.5, "smoothed speeds differ from the known speed"
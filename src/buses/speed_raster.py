@@ -0,0 +1,174 @@
+""" Fleet-wide speed raster: bus speeds per grid cell per time bucket. """
+
+import math
+import os
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from folium.plugins import TimestampedGeoJson
+
+import global_data
+
+METRES_PER_DEGREE = 111195  # of latitude
+
+class SpeedRaster:
+    def __init__(self, intervals_df=None, cell_size=None, bucket=None, bounds=None):
+        """ Prepares a grid of cell_size metres within bounds (south-west and north-east corners)
+        and buckets of bucket seconds, filled from intervals_df if given. """
+
+        self.cell_size = cell_size or global_data.RASTER_CELL_SIZE
+        self.bucket = bucket or global_data.RASTER_BUCKET
+        (self.lat_min, self.lon_min), (self.lat_max, self.lon_max) = bounds or global_data.WARSAW_BOUNDS
+
+        self.lat_step = self.cell_size / METRES_PER_DEGREE
+        self.lon_step = self.lat_step / math.cos(math.radians((self.lat_min + self.lat_max) / 2))
+        self.n_rows = math.ceil((self.lat_max - self.lat_min) / self.lat_step)
+        self.n_cols = math.ceil((self.lon_max - self.lon_min) / self.lon_step)
+        self.n_cells = self.n_rows * self.n_cols  # cell = row * n_cols + col, rows from the south
+
+        self.start = None  # pd.Timestamp of the first bucket
+        self.count = np.zeros((0, self.n_cells), dtype=np.int32)  # (buckets, cells)
+        self.mean = np.zeros((0, self.n_cells), dtype=np.float32)  # km/h, NaN without data
+        self.median = np.zeros((0, self.n_cells), dtype=np.float32)  # km/h, NaN without data
+
+        if intervals_df is not None:
+            self.fill(intervals_df)
+
+    def fill(self, intervals_df):
+        """ Bins speeds of intervals_df {speed, mid_lat, mid_lon, mid_time} by the cell and
+        bucket of their midpoints, in a single scatter-add over all intervals.
+        Intervals outside the bounds are skipped. """
+
+        intervals_df = intervals_df.dropna(subset=["speed", "mid_lat", "mid_lon", "mid_time"])
+        lat = intervals_df["mid_lat"].to_numpy(dtype=float)
+        lon = intervals_df["mid_lon"].to_numpy(dtype=float)
+        inside = ((lat >= self.lat_min) & (lat < self.lat_max) &
+                  (lon >= self.lon_min) & (lon < self.lon_max))
+        intervals_df = intervals_df[inside]
+        if intervals_df.empty:
+            return
+
+        rows = ((lat[inside] - self.lat_min) / self.lat_step).astype(int)
+        cols = ((lon[inside] - self.lon_min) / self.lon_step).astype(int)
+        cells = rows * self.n_cols + cols
+
+        times = pd.to_datetime(intervals_df["mid_time"])
+        self.start = times.min().floor(f"{self.bucket}s")
+        buckets = ((times - self.start).dt.total_seconds().to_numpy() // self.bucket).astype(int)
+        n_buckets = buckets.max() + 1
+
+        flat = buckets * self.n_cells + cells
+        speeds = intervals_df["speed"].to_numpy(dtype=float)
+        count = np.bincount(flat, minlength=n_buckets * self.n_cells)
+        total = np.bincount(flat, weights=speeds, minlength=n_buckets * self.n_cells)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, total / count, np.nan)
+
+        # medians from speeds sorted within each (bucket, cell)
+        order = np.lexsort((speeds, flat))
+        sorted_flat = flat[order]
+        sorted_speeds = speeds[order]
+        starts = np.flatnonzero(np.r_[True, sorted_flat[1:] != sorted_flat[:-1]])
+        sizes = np.diff(np.r_[starts, len(sorted_flat)])
+        median = np.full(n_buckets * self.n_cells, np.nan)
+        median[sorted_flat[starts]] = (sorted_speeds[starts + (sizes - 1) // 2] +
+                                       sorted_speeds[starts + sizes // 2]) / 2
+
+        self.count = count.reshape(n_buckets, self.n_cells).astype(np.int32)
+        self.mean = mean.reshape(n_buckets, self.n_cells).astype(np.float32)
+        self.median = median.reshape(n_buckets, self.n_cells).astype(np.float32)
+
+    def bucket_times(self):
+        """ Returns start times of all buckets. """
+        if self.start is None:
+            return pd.DatetimeIndex([])
+        return pd.date_range(self.start, periods=len(self.count), freq=f"{self.bucket}s")
+
+    def cell_corners(self, cells):
+        """ Returns south-west and north-east corners of cells as (lat, lon) arrays. """
+        rows, cols = np.divmod(np.asarray(cells), self.n_cols)
+        south = self.lat_min + rows * self.lat_step
+        west = self.lon_min + cols * self.lon_step
+        return (south, west), (south + self.lat_step, west + self.lon_step)
+
+    def save(self, file_name):
+        """ Saves the raster as a compressed .npz file. """
+        np.savez_compressed(file_name, count=self.count, mean=self.mean, median=self.median,
+                            cell_size=self.cell_size, bucket=self.bucket,
+                            bounds=[[self.lat_min, self.lon_min], [self.lat_max, self.lon_max]],
+                            start="" if self.start is None else str(self.start))
+
+    @classmethod
+    def load(cls, file_name):
+        """ Reads a raster saved by save. """
+        data = np.load(file_name)
+        raster = cls(cell_size=float(data["cell_size"]), bucket=int(data["bucket"]),
+                     bounds=tuple(map(tuple, data["bounds"])))
+        start = str(data["start"])
+        raster.start = pd.Timestamp(start) if start else None  # empty raster
+        raster.count, raster.mean, raster.median = data["count"], data["mean"], data["median"]
+        return raster
+
+    def save_frames(self, directory):
+        """ Saves mean speeds of every bucket with data as a numbered png image. """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        extent = [self.lon_min, self.lon_min + self.n_cols * self.lon_step,
+                  self.lat_min, self.lat_min + self.n_rows * self.lat_step]
+        fig, ax = plt.subplots()
+        image = ax.imshow(np.full((self.n_rows, self.n_cols), np.nan), origin="lower",
+                          extent=extent, cmap="RdYlGn", vmin=0,
+                          vmax=global_data.RASTER_MAX_SPEED,
+                          aspect=1 / math.cos(math.radians((self.lat_min + self.lat_max) / 2)))
+        fig.colorbar(image, ax=ax, label="Mean Speed (km/h)")
+        ax.set_xlabel("Longitude")
+        ax.set_ylabel("Latitude")
+
+        for i, bucket_time in enumerate(self.bucket_times()):
+            if not self.count[i].any():
+                continue
+            image.set_data(self.mean[i].reshape(self.n_rows, self.n_cols))
+            ax.set_title(f"Mean Bus Speed, {bucket_time.strftime('%Y-%m-%d %H:%M')}")
+            fig.savefig(os.path.join(directory, f"{i:04d}.png"), dpi=150)
+        plt.close(fig)
+
+    def visualize(self, speed_map, file_name):
+        """ Adds cells coloured by mean speed, changing every bucket, to speed_map
+        and saves it as file_name. Every cell of every frame is a separate feature, so only
+        the first global_data.RASTER_MAP_FRAMES frames with data are shown - the map is meant
+        for short sessions, longer ones are better viewed as the png frames of save_frames. """
+        colours = LinearColormap(["red", "yellow", "green"], vmin=0,
+                                 vmax=global_data.RASTER_MAX_SPEED, caption="Mean speed (km/h)")
+        bucket_times = self.bucket_times()
+
+        shown = np.flatnonzero(self.count.any(axis=1))
+        if len(shown) > global_data.RASTER_MAP_FRAMES:
+            print(f"Speed raster map shows only the first {global_data.RASTER_MAP_FRAMES} "
+                  f"of {len(shown)} frames, see the png frames for all of them.")
+            shown = shown[:global_data.RASTER_MAP_FRAMES]
+        buckets, cells = np.nonzero(self.count[shown])
+        buckets = shown[buckets]
+        (south, west), (north, east) = self.cell_corners(cells)
+        features = []
+        for bucket, cell, s, w, n, e in zip(buckets, cells, south, west, north, east):
+            mean = float(self.mean[bucket, cell])
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon",
+                             "coordinates": [[[w, s], [e, s], [e, n], [w, n], [w, s]]]},
+                "properties": {
+                    "times": [bucket_times[bucket].isoformat()],
+                    "style": {"color": colours(mean), "fillColor": colours(mean),
+                              "fillOpacity": 0.6, "weight": 0},
+                    "popup": f"{mean:.1f} km/h (median {self.median[bucket, cell]:.1f}, "
+                             f"{self.count[bucket, cell]} intervals)",
+                },
+            })
+
+        TimestampedGeoJson({"type": "FeatureCollection", "features": features},
+                           period=f"PT{self.bucket}S", duration=f"PT{self.bucket}S",
+                           add_last_point=False, auto_play=False).add_to(speed_map)
+        colours.add_to(speed_map)
+        speed_map.save(file_name)